@@ -1,9 +1,19 @@
 # config.py
 import enum
+import json
 from datetime import datetime, timedelta
 from typing import Dict, Any, Set, Optional, Tuple
 import logging
 
+try:
+    import orjson
+
+    def json_dumps_bytes(obj) -> bytes:
+        return orjson.dumps(obj, default=str)
+except ImportError:  # orjson is optional; stdlib json is the fallback
+    def json_dumps_bytes(obj) -> bytes:
+        return json.dumps(obj, default=str).encode()
+
 class EventPriority(enum.IntEnum):
     CRITICAL = 1
     HIGH = 2
@@ -19,6 +29,7 @@ class Config:
     # Queue settings
     MAX_QUEUE_SIZE = 1000
     MAX_CLIENT_EVENTS = 100
+    DISTRIBUTOR_BATCH_SIZE = 64
     
     # Retry settings
     MAX_RETRIES = 3
@@ -33,7 +44,7 @@ class Config:
     SQLALCHEMY_TRACK_MODIFICATIONS = False
 
 # models.py
-from sqlalchemy import Column, Integer, String, DateTime, JSON, Boolean, ForeignKey, Enum as SQLAEnum
+from sqlalchemy import Column, Index, Integer, String, DateTime, JSON, Boolean, ForeignKey, Enum as SQLAEnum
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import relationship
 
@@ -41,8 +52,14 @@ Base = declarative_base()
 
 class QueuedEvent(Base):
     __tablename__ = 'queued_events'
+    # Composite index so recovery is an index scan instead of a full
+    # table scan + sort on status
+    __table_args__ = (
+        Index('ix_queued_status_prio_ctime', 'status', 'priority', 'created_at'),
+    )
     
-    id = Column(Integer, primary_key=True)
+    # Client-generated uuid4 hex so inserts can be deferred to the flusher
+    id = Column(String(32), primary_key=True)
     event_type = Column(String(50), nullable=False, index=True)
     data = Column(JSON, nullable=False)
     user_id = Column(Integer, nullable=True, index=True)
@@ -78,6 +95,19 @@ class EventValidator:
         
         return True, ""
 
+def event_expired(event: dict) -> bool:
+    """Cheap hot-path expiration check.
+
+    Prefers the epoch timestamp cached at creation; only falls back to
+    parsing the ISO string for events that predate the cache.
+    """
+    ts = event.get('expires_at_ts')
+    if ts is not None:
+        return ts < time.time()
+    if event.get('expired_at'):
+        return datetime.fromisoformat(event['expired_at']) < datetime.utcnow()
+    return False
+
 class Metrics:
     def __init__(self):
         self._lock = threading.Lock()
@@ -90,7 +120,9 @@ class Metrics:
             self.failed_events = 0
             self.global_events = 0
             self.user_events = 0
-            self.delivery_times = []
+            # Running aggregates instead of an unbounded list of samples
+            self._dt_count = 0
+            self._dt_sum = 0.0
             self.start_time = datetime.utcnow()
     
     def record_event(self, event_type: str, status: EventStatus, delivery_time: Optional[float] = None):
@@ -108,7 +140,8 @@ class Metrics:
                 self.user_events += 1
             
             if delivery_time is not None:
-                self.delivery_times.append(delivery_time)
+                self._dt_count += 1
+                self._dt_sum += delivery_time
     
     def get_stats(self) -> dict:
         with self._lock:
@@ -118,21 +151,47 @@ class Metrics:
                 'failed_events': self.failed_events,
                 'global_events': self.global_events,
                 'user_events': self.user_events,
-                'avg_delivery_time': (sum(self.delivery_times) / len(self.delivery_times)) 
-                    if self.delivery_times else 0,
+                'avg_delivery_time': (self._dt_sum / self._dt_count)
+                    if self._dt_count else 0,
                 'uptime': (datetime.utcnow() - self.start_time).total_seconds()
             }
 
 # storage.py
+import uuid
 from contextlib import contextmanager
-from sqlalchemy import create_engine
+from sqlalchemy import bindparam, create_engine, select, update
 from sqlalchemy.orm import sessionmaker, scoped_session
 
 class EventStorage:
+    # Write-behind flusher settings: commit once per interval or batch,
+    # whichever comes first
+    FLUSH_INTERVAL = 0.01  # seconds
+    FLUSH_BATCH = 100
+
     def __init__(self, db_url: str):
-        self.engine = create_engine(db_url)
+        # Size the pool for concurrent Flask workers + the distributor and
+        # flusher threads; pre-ping drops stale connections before use
+        engine_kwargs = dict(pool_pre_ping=True, pool_recycle=1800, future=True)
+        if db_url.startswith('sqlite'):
+            engine_kwargs['connect_args'] = {'check_same_thread': False}
+        else:
+            engine_kwargs.update(pool_size=20, max_overflow=40)
+        self.engine = create_engine(db_url, **engine_kwargs)
         self.Session = scoped_session(sessionmaker(bind=self.engine))
         Base.metadata.create_all(self.engine)
+        self._pending_inserts = deque()
+        self._pending_delivered = deque()
+        # Precompiled once; the flusher reuses it instead of rebuilding the
+        # ORM query (SELECT + identity map) per delivery batch
+        self._stmt_deliver = (
+            update(QueuedEvent)
+            .where(QueuedEvent.id.in_(bindparam('ids', expanding=True)))
+            .values(status=EventStatus.DELIVERED, delivered_at=bindparam('ts'))
+            .execution_options(synchronize_session=False)
+        )
+        self._flush_wakeup = threading.Event()
+        self._flusher = threading.Thread(target=self._flush_loop, daemon=True)
+        self._flusher.start()
     
     @contextmanager
     def session_scope(self):
@@ -146,72 +205,253 @@ class EventStorage:
         finally:
             session.close()
     
-    def store_event(self, event_data: dict) -> QueuedEvent:
+    def store_event(self, event_data: dict) -> str:
+        """Buffer the event for the background flusher.
+
+        Returns a client-generated id immediately so callers never wait
+        on the INSERT round trip or the autoincrement value.
+        """
+        event_id = uuid.uuid4().hex
+        self._pending_inserts.append({
+            'id': event_id,
+            'event_type': event_data['type'],
+            'data': event_data['data'],
+            'user_id': event_data.get('user_id'),
+            'is_global': event_data.get('is_global', False),
+            'priority': event_data.get('priority', EventPriority.NORMAL),
+            'status': EventStatus.PENDING,
+            'created_at': datetime.utcnow(),
+            'expired_at': datetime.fromisoformat(event_data['expired_at'])
+                if 'expired_at' in event_data else None,
+            'retry_count': 0,
+        })
+        if len(self._pending_inserts) >= self.FLUSH_BATCH:
+            self._flush_wakeup.set()
+        return event_id
+
+    def _flush_loop(self):
+        while True:
+            self._flush_wakeup.wait(self.FLUSH_INTERVAL)
+            self._flush_wakeup.clear()
+            try:
+                self.flush()
+            except Exception as e:
+                logging.error(f"Error flushing event writes: {e}")
+
+    def flush(self):
+        rows = []
+        while self._pending_inserts:
+            rows.append(self._pending_inserts.popleft())
+        delivered_ids = []
+        while self._pending_delivered:
+            delivered_ids.append(self._pending_delivered.popleft())
+        if not rows and not delivered_ids:
+            return
         with self.session_scope() as session:
-            event = QueuedEvent(
-                event_type=event_data['type'],
-                data=event_data['data'],
-                user_id=event_data.get('user_id'),
-                is_global=event_data.get('is_global', False),
-                priority=event_data.get('priority', EventPriority.NORMAL),
-                expired_at=datetime.fromisoformat(event_data['expired_at'])
-                    if 'expired_at' in event_data else None
-            )
-            session.add(event)
-            session.commit()
-            return event
+            if rows:
+                session.bulk_insert_mappings(QueuedEvent, rows)
+            if delivered_ids:
+                session.execute(
+                    self._stmt_deliver,
+                    {'ids': delivered_ids, 'ts': datetime.utcnow()}
+                )
     
-    def mark_delivered(self, event_id: int):
+    def load_pending_events(self, limit: int = 500) -> list:
+        """Fetch undelivered events for recovery.
+
+        Returns plain column Rows, not QueuedEvent instances: ORM objects
+        would be expired and detached once session_scope commits and
+        closes, and the first attribute access after return would raise
+        DetachedInstanceError. SKIP LOCKED keeps concurrent recovering
+        workers off the same rows while the select runs (no-op on
+        SQLite); the locks are released when the session closes.
+        """
         with self.session_scope() as session:
-            event = session.query(QueuedEvent).get(event_id)
-            if event:
-                event.status = EventStatus.DELIVERED
-                event.delivered_at = datetime.utcnow()
+            stmt = (
+                select(QueuedEvent.id, QueuedEvent.event_type, QueuedEvent.data,
+                       QueuedEvent.user_id, QueuedEvent.is_global,
+                       QueuedEvent.priority, QueuedEvent.expired_at)
+                .where(QueuedEvent.status == EventStatus.PENDING)
+                .order_by(QueuedEvent.priority, QueuedEvent.created_at)
+                .limit(limit)
+                .with_for_update(skip_locked=True)
+            )
+            return session.execute(stmt).all()
+
+    def mark_delivered(self, event_id):
+        self._pending_delivered.append(event_id)
+        if len(self._pending_delivered) >= self.FLUSH_BATCH:
+            self._flush_wakeup.set()
+
+    def mark_delivered_many(self, event_ids: list):
+        # Buffered like the inserts, never a direct UPDATE: the distributor
+        # drains an event microseconds after store_event buffers its row,
+        # so an immediate UPDATE would usually run before the INSERT lands
+        # and match zero rows. flush() applies pending inserts before
+        # pending delivered-updates in one session, which keeps the
+        # ordering right by construction.
+        if not event_ids:
+            return
+        self._pending_delivered.extend(event_ids)
+        if len(self._pending_delivered) >= self.FLUSH_BATCH:
+            self._flush_wakeup.set()
 
 # connection.py
+import heapq
+import itertools
 import queue
 import threading
 import time
-from collections import defaultdict
+from collections import OrderedDict, defaultdict, deque
+
+class ClientStream:
+    """Per-client SSE buffer built on deque + Event instead of queue.Queue.
+
+    deque.append/popleft are atomic under the GIL, so the broadcaster takes
+    no Python-level lock per client; maxlen silently drops the oldest event
+    when a slow client falls behind. The Event wakes the consumer generator.
+    """
+
+    __slots__ = ('events', 'wakeup')
+
+    def __init__(self, maxlen: int = Config.MAX_CLIENT_EVENTS):
+        self.events: deque = deque(maxlen=maxlen)
+        self.wakeup = threading.Event()
+
+    def push(self, event: dict):
+        self.events.append(event)
+        self.wakeup.set()
 
 class ConnectionManager:
+    # Number of lock stripes; must be a power of two so `user_id & (N - 1)` works
+    NUM_STRIPES = 64
+
     def __init__(self, max_connections_per_user: int = Config.MAX_CONNECTIONS_PER_USER):
         self.max_connections = max_connections_per_user
-        self.user_connections: Dict[int, Set[queue.Queue]] = defaultdict(set)
-        self.connection_times: Dict[int, float] = {}
-        self._lock = threading.Lock()
-    
-    def add_connection(self, user_id: int, stream: queue.Queue) -> bool:
-        with self._lock:
-            if len(self.user_connections[user_id]) >= self.max_connections:
-                # Remove oldest connection
-                oldest_stream = min(
-                    self.user_connections[user_id],
-                    key=lambda s: self.connection_times.get(id(s), 0)
-                )
-                self.remove_connection(user_id, oldest_stream)
-            
-            self.user_connections[user_id].add(stream)
-            self.connection_times[id(stream)] = time.time()
+        # stream -> connect time; insertion order doubles as age, making
+        # oldest-connection eviction an O(1) popitem
+        self.user_connections: Dict[int, 'OrderedDict[ClientStream, float]'] = defaultdict(OrderedDict)
+        # Striped locks: each user's stream set is guarded only by its stripe,
+        # so broadcast to user A never blocks register/unregister for user B.
+        self._stripes = [threading.Lock() for _ in range(self.NUM_STRIPES)]
+        # Guards structural changes (key insert/delete) of user_connections only
+        self._map_lock = threading.RLock()
+        # Flat snapshot of every stream, rebuilt only on add/remove so the
+        # broadcast path reads it without any lock (tuple swap is atomic)
+        self._all_streams_tuple: tuple = ()
+        # Pre-bound push methods so the fan-out loop is a bare call per
+        # subscriber with no attribute lookup
+        self._all_push_tuple: tuple = ()
+
+    def _stripe(self, user_id: int) -> threading.Lock:
+        return self._stripes[user_id & (self.NUM_STRIPES - 1)]
+
+    def add_connection(self, user_id: int, stream: ClientStream) -> bool:
+        with self._stripe(user_id):
+            with self._map_lock:
+                streams = self.user_connections[user_id]
+            if len(streams) >= self.max_connections:
+                # Remove oldest connection: first inserted is first out
+                streams.popitem(last=False)
+
+            streams[stream] = time.time()
+            self._rebuild_snapshot()
             return True
+
+    def remove_connection(self, user_id: int, stream: ClientStream):
+        with self._stripe(user_id):
+            streams = self.user_connections.get(user_id)
+            if streams is None:
+                return
+            streams.pop(stream, None)
+
+            if not streams:
+                with self._map_lock:
+                    self.user_connections.pop(user_id, None)
+            self._rebuild_snapshot()
+
+    def is_online(self, user_id: int) -> bool:
+        # Cheap probe for dispatch decisions; avoids the set copy that
+        # get_user_streams makes
+        with self._stripe(user_id):
+            return bool(self.user_connections.get(user_id))
+
+    def get_user_streams(self, user_id: int) -> Set[ClientStream]:
+        with self._stripe(user_id):
+            return set(self.user_connections.get(user_id, ()))
+
+    def for_each_stream(self, user_id: int, callback):
+        # Iterates under the stripe lock with no intermediate container;
+        # callback must be O(1) to keep the hold time bounded
+        with self._stripe(user_id):
+            for stream in self.user_connections.get(user_id, ()):
+                callback(stream)
     
-    def remove_connection(self, user_id: int, stream: queue.Queue):
-        with self._lock:
-            if stream in self.user_connections[user_id]:
-                self.user_connections[user_id].remove(stream)
-                self.connection_times.pop(id(stream), None)
-            
-            if not self.user_connections[user_id]:
-                del self.user_connections[user_id]
-    
-    def get_user_streams(self, user_id: int) -> Set[queue.Queue]:
-        return self.user_connections.get(user_id, set())
-    
-    def get_all_streams(self) -> Set[queue.Queue]:
-        all_streams = set()
-        for streams in self.user_connections.values():
-            all_streams.update(streams)
-        return all_streams
+    def _rebuild_snapshot(self):
+        with self._map_lock:
+            self._all_streams_tuple = tuple(
+                s for streams in self.user_connections.values() for s in streams
+            )
+            self._all_push_tuple = tuple(s.push for s in self._all_streams_tuple)
+
+    def broadcast(self, event: dict):
+        for push in self._all_push_tuple:
+            push(event)
+
+    def get_all_streams(self) -> tuple:
+        # Lock-free read; rebuild cost is paid at (rare) connect/disconnect
+        # instead of at every broadcast
+        return self._all_streams_tuple
+
+class PriorityEventQueue:
+    """Two-level priority queue: one C-implemented SimpleQueue per priority,
+    drained in priority order by the single consumer.
+
+    SimpleQueue.put has a lock-free fast path, so the many producers never
+    contend on a shared Condition; a Semaphore carries the item count and
+    wakes the distributor. Items stay (priority, event) pairs as with the
+    stdlib PriorityQueue. maxsize is enforced approximately (the check and
+    the put are not atomic), which suffices for overload protection.
+    """
+
+    def __init__(self, maxsize: int = 0):
+        self._queues = {p: queue.SimpleQueue() for p in EventPriority}
+        self._notify = threading.Semaphore(0)
+        self._maxsize = maxsize
+
+    def put_nowait(self, item):
+        priority, event = item
+        if self._maxsize > 0 and self.qsize() >= self._maxsize:
+            raise queue.Full
+        self._queues[priority].put(event)
+        self._notify.release()
+
+    def put(self, item, timeout: Optional[float] = None):
+        self.put_nowait(item)
+
+    def _pop(self):
+        for priority in EventPriority:
+            try:
+                return priority, self._queues[priority].get_nowait()
+            except queue.Empty:
+                continue
+        raise queue.Empty
+
+    def get(self, timeout: Optional[float] = None):
+        if not self._notify.acquire(timeout=timeout):
+            raise queue.Empty
+        return self._pop()
+
+    def get_nowait(self):
+        if not self._notify.acquire(blocking=False):
+            raise queue.Empty
+        return self._pop()
+
+    def qsize(self) -> int:
+        return sum(q.qsize() for q in self._queues.values())
+
+    def empty(self) -> bool:
+        return self.qsize() == 0
 
 # event_system.py
 class EnhancedEventNotificationSystem:
@@ -220,14 +460,28 @@ class EnhancedEventNotificationSystem:
         self.metrics = Metrics()
         self.connection_manager = ConnectionManager()
         
-        self.global_event_queue = queue.PriorityQueue(maxsize=Config.MAX_QUEUE_SIZE)
+        self.global_event_queue = PriorityEventQueue(maxsize=Config.MAX_QUEUE_SIZE)
         self.user_event_queues: Dict[int, queue.Queue] = {}
         
         self.is_shutting_down = False
-        self._lock = threading.Lock()
-        
+        self._emitters: Dict[tuple, Any] = {}
+
+        # Retry wheel: one heap + one thread instead of a Timer per failure
+        self._retry_heap = []
+        self._retry_seq = itertools.count()
+        self._retry_cv = threading.Condition()
+
+        # Expiry janitor: a (ts, id) heap swept once per second into a set,
+        # so the dispatch filter is one set lookup instead of a clock read
+        # and comparison per event
+        self._expiry_heap = []
+        self._expiry_lock = threading.Lock()
+        self.expired_ids = set()
+
         # Start system
         self.start_event_distributor()
+        self.start_retry_scheduler()
+        self.start_expiry_janitor()
         self.load_stored_events()
         
         # Register shutdown handlers
@@ -236,14 +490,17 @@ class EnhancedEventNotificationSystem:
     
     def create_event(self, event_type: str, data: Any, user_id: Optional[int] = None,
                     is_global: bool = False, priority: EventPriority = EventPriority.NORMAL,
-                    expires_in: int = 3600) -> int:
+                    expires_in: int = 3600) -> str:
         event_data = {
             'type': event_type,
             'data': data,
             'user_id': user_id,
             'is_global': is_global,
             'priority': priority,
-            'expired_at': (datetime.utcnow() + timedelta(seconds=expires_in)).isoformat()
+            'expired_at': (datetime.utcnow() + timedelta(seconds=expires_in)).isoformat(),
+            # Epoch copy of expired_at so hot paths compare floats instead
+            # of parsing ISO strings and allocating datetimes per event
+            'expires_at_ts': time.time() + expires_in
         }
         
         # Validate event
@@ -251,80 +508,192 @@ class EnhancedEventNotificationSystem:
         if not is_valid:
             raise ValueError(f"Invalid event: {error}")
         
-        # Store in database
-        stored_event = self.storage.store_event(event_data)
-        event_data['id'] = stored_event.id
+        # Store in database (buffered; returns the client-generated id)
+        event_data['id'] = self.storage.store_event(event_data)
+
+        # Serialize the SSE wire frame once here instead of once per
+        # subscriber; bytes all the way so WSGI never re-encodes
+        event_data['_frame'] = (
+            b"event: " + event_type.encode() + b"\ndata: "
+            + json_dumps_bytes(event_data) + b"\n\n"
+        )
         
         # Add to queue
+        self._track_expiry(event_data)
         try:
             self.global_event_queue.put_nowait((priority, event_data))
         except queue.Full:
             logging.error("Global event queue is full")
             raise RuntimeError("Event system is overloaded")
         
-        return stored_event.id
+        return event_data['id']
     
+    def _track_expiry(self, event_data: dict):
+        ts = event_data.get('expires_at_ts')
+        if ts is not None:
+            with self._expiry_lock:
+                heapq.heappush(self._expiry_heap, (ts, event_data['id']))
+
+    def start_expiry_janitor(self):
+        def janitor():
+            while not self.is_shutting_down:
+                time.sleep(1)
+                now = time.time()
+                with self._expiry_lock:
+                    if len(self.expired_ids) > Config.MAX_QUEUE_SIZE:
+                        # anything this old has long left the queues
+                        self.expired_ids = set()
+                    while self._expiry_heap and self._expiry_heap[0][0] < now:
+                        _ts, event_id = heapq.heappop(self._expiry_heap)
+                        self.expired_ids.add(event_id)
+
+        janitor_thread = threading.Thread(target=janitor, daemon=True)
+        janitor_thread.start()
+
+    def make_emitter(self, event_type: str, is_global: bool = False,
+                     priority: EventPriority = EventPriority.NORMAL):
+        """Return a fast-path emitter specialized for one event type.
+
+        Validation, branching and name lookups happen once here; the
+        returned closure only builds the event dict, stores and enqueues
+        it. Emitters are cached per (event_type, is_global, priority).
+        """
+        key = (event_type, is_global, priority)
+        emitter = self._emitters.get(key)
+        if emitter is not None:
+            return emitter
+
+        event_type_bytes = event_type.encode()
+        store = self.storage.store_event
+        enqueue = self.global_event_queue.put_nowait
+
+        def emit(data: Any, user_id: Optional[int] = None, expires_in: int = 3600) -> str:
+            event_data = {
+                'type': event_type,
+                'data': data,
+                'user_id': user_id,
+                'is_global': is_global,
+                'priority': priority,
+                'expired_at': (datetime.utcnow() + timedelta(seconds=expires_in)).isoformat(),
+                'expires_at_ts': time.time() + expires_in,
+            }
+            event_data['id'] = store(event_data)
+            event_data['_frame'] = (b"event: " + event_type_bytes + b"\ndata: "
+                                    + json_dumps_bytes(event_data) + b"\n\n")
+            self._track_expiry(event_data)
+            enqueue((priority, event_data))
+            return event_data['id']
+
+        self._emitters[key] = emit
+        return emit
+
     def start_event_distributor(self):
         def distributor():
             while not self.is_shutting_down:
                 try:
                     priority, event = self.global_event_queue.get(timeout=1)
-                    
-                    # Check expiration
-                    if 'expired_at' in event:
-                        expired_at = datetime.fromisoformat(event['expired_at'])
-                        if expired_at < datetime.utcnow():
-                            continue
-                    
-                    start_time = time.time()
-                    
-                    if event.get('is_global', False):
-                        self._distribute_global_event(event)
-                    else:
-                        self._distribute_user_specific_event(event)
-                    
-                    # Record metrics
-                    delivery_time = time.time() - start_time
-                    self.metrics.record_event(
-                        'global' if event.get('is_global') else 'user',
-                        EventStatus.DELIVERED,
-                        delivery_time
-                    )
-                    
-                    # Mark as delivered
-                    self.storage.mark_delivered(event['id'])
-                
                 except queue.Empty:
                     continue
+
+                # Drain a batch per wakeup so the queue lock and the
+                # delivered-status write are amortized over many events
+                batch = [event]
+                try:
+                    while len(batch) < Config.DISTRIBUTOR_BATCH_SIZE:
+                        priority, event = self.global_event_queue.get_nowait()
+                        batch.append(event)
+                except queue.Empty:
+                    pass
+
+                delivered_ids = []
+                for event in batch:
+                    try:
+                        # One set lookup; the janitor thread does the clock
+                        # reads and timestamp comparisons out of band
+                        if event.get('id') in self.expired_ids:
+                            continue
+
+                        start_time = time.time()
+
+                        if event.get('is_global', False):
+                            self._distribute_global_event(event)
+                        else:
+                            self._distribute_user_specific_event(event)
+
+                        # Record metrics
+                        delivery_time = time.time() - start_time
+                        self.metrics.record_event(
+                            'global' if event.get('is_global') else 'user',
+                            EventStatus.DELIVERED,
+                            delivery_time
+                        )
+                        delivered_ids.append(event['id'])
+                    except Exception as e:
+                        logging.error(f"Error in distributor: {e}")
+
+                # Mark the whole batch delivered in one statement
+                try:
+                    self.storage.mark_delivered_many(delivered_ids)
                 except Exception as e:
-                    logging.error(f"Error in distributor: {e}")
+                    logging.error(f"Error marking events delivered: {e}")
         
         distributor_thread = threading.Thread(target=distributor, daemon=True)
         distributor_thread.start()
     
+    def load_stored_events(self):
+        try:
+            for row in self.storage.load_pending_events():
+                priority = EventPriority(row.priority or EventPriority.NORMAL)
+                event_data = {
+                    'id': row.id,
+                    'type': row.event_type,
+                    'data': row.data,
+                    'user_id': row.user_id,
+                    'is_global': row.is_global,
+                    'priority': priority,
+                }
+                if row.expired_at:
+                    event_data['expired_at'] = row.expired_at.isoformat()
+                try:
+                    self.global_event_queue.put_nowait((priority, event_data))
+                except queue.Full:
+                    break
+        except Exception as e:
+            logging.error(f"Error loading stored events: {e}")
+
+    def start_retry_scheduler(self):
+        def scheduler():
+            while not self.is_shutting_down:
+                with self._retry_cv:
+                    if not self._retry_heap:
+                        self._retry_cv.wait(timeout=1)
+                        continue
+                    due_ts = self._retry_heap[0][0]
+                    now = time.time()
+                    if due_ts > now:
+                        self._retry_cv.wait(timeout=due_ts - now)
+                        continue
+                    _due, _seq, event = heapq.heappop(self._retry_heap)
+                try:
+                    self.global_event_queue.put(
+                        (event.get('priority', EventPriority.NORMAL), event)
+                    )
+                except queue.Full:
+                    logging.error(f"Queue full, dropping retry for event {event.get('id')}")
+
+        scheduler_thread = threading.Thread(target=scheduler, daemon=True)
+        scheduler_thread.start()
+
     def _distribute_global_event(self, event: dict):
-        all_streams = self.connection_manager.get_all_streams()
-        for stream in all_streams:
-            try:
-                stream.put_nowait(event)
-            except queue.Full:
-                logging.warning(f"Stream full for event {event['id']}")
-    
+        # deque maxlen drops the oldest event if a client is behind;
+        # no per-client lock is taken on this path
+        self.connection_manager.broadcast(event)
+
     def _distribute_user_specific_event(self, event: dict):
         user_id = event['user_id']
-        user_streams = self.connection_manager.get_user_streams(user_id)
-        
-        if user_streams:
-            delivered = False
-            for stream in user_streams:
-                try:
-                    stream.put_nowait(event)
-                    delivered = True
-                except queue.Full:
-                    continue
-            
-            if not delivered:
-                self._handle_failed_delivery(event, "All user streams full")
+
+        if self.connection_manager.is_online(user_id):
+            self.connection_manager.for_each_stream(user_id, lambda stream: stream.push(event))
         else:
             # Queue for later delivery
             if user_id not in self.user_event_queues:
@@ -337,22 +706,35 @@ class EnhancedEventNotificationSystem:
                 self._handle_failed_delivery(event, "User queue full")
     
     def _handle_failed_delivery(self, event: dict, error: str):
+        # The event dict carries its own retry count, so no SELECT is
+        # needed just to decide the next state: issue one blind UPDATE
         try:
-            with self.storage.session_scope() as session:
-                queued_event = session.query(QueuedEvent).get(event['id'])
-                if queued_event and queued_event.retry_count < Config.MAX_RETRIES:
-                    queued_event.retry_count += 1
-                    queued_event.status = EventStatus.PENDING
-                    # Schedule retry
-                    threading.Timer(
-                        Config.RETRY_DELAY,
-                        lambda: self.global_event_queue.put(
-                            (event.get('priority', EventPriority.NORMAL), event)
-                        )
-                    ).start()
-                else:
-                    queued_event.status = EventStatus.FAILED
-                    logging.error(f"Event {event['id']} failed: {error}")
+            retries = event.get('retry_count', 0)
+            if retries < Config.MAX_RETRIES:
+                event['retry_count'] = retries + 1
+                with self.storage.session_scope() as session:
+                    session.execute(
+                        update(QueuedEvent)
+                        .where(QueuedEvent.id == event['id'])
+                        .values(retry_count=retries + 1, status=EventStatus.PENDING)
+                        .execution_options(synchronize_session=False)
+                    )
+                # Schedule retry on the shared wheel
+                with self._retry_cv:
+                    heapq.heappush(
+                        self._retry_heap,
+                        (time.time() + Config.RETRY_DELAY, next(self._retry_seq), event)
+                    )
+                    self._retry_cv.notify()
+            else:
+                with self.storage.session_scope() as session:
+                    session.execute(
+                        update(QueuedEvent)
+                        .where(QueuedEvent.id == event['id'])
+                        .values(status=EventStatus.FAILED)
+                        .execution_options(synchronize_session=False)
+                    )
+                logging.error(f"Event {event['id']} failed: {error}")
         except Exception as e:
             logging.error(f"Error handling failed delivery: {e}")
 
@@ -369,26 +751,29 @@ def create_app(config_object=Config):
     @app.route('/events/stream')
     @login_required
     def event_stream():
-        user_stream = queue.Queue(maxsize=Config.MAX_CLIENT_EVENTS)
+        user_stream = ClientStream(maxlen=Config.MAX_CLIENT_EVENTS)
         user_id = current_user.id
-        
+
         event_system.connection_manager.add_connection(user_id, user_stream)
-        
+
         def generate():
             try:
                 while not event_system.is_shutting_down:
-                    try:
-                        event = user_stream.get(timeout=Config.HEARTBEAT_INTERVAL)
-                        
-                        # Check expiration
-                        if event.get('expired_at'):
-                            expired_at = datetime.fromisoformat(event['expired_at'])
-                            if expired_at < datetime.utcnow():
-                                continue
-                        
-                        yield f"event: {event['type']}\ndata: {json.dumps(event)}\n\n"
-                    except queue.Empty:
+                    if not user_stream.wakeup.wait(timeout=Config.HEARTBEAT_INTERVAL):
                         yield "event: heartbeat\ndata: keep-alive\n\n"
+                        continue
+                    user_stream.wakeup.clear()
+                    while user_stream.events:
+                        event = user_stream.events.popleft()
+
+                        if event_expired(event):
+                            continue
+
+                        frame = event.get('_frame')
+                        if frame is None:
+                            frame = (b"event: " + event['type'].encode()
+                                     + b"\ndata: " + json_dumps_bytes(event) + b"\n\n")
+                        yield frame
             finally:
                 event_system.connection_manager.remove_connection(user_id, user_stream)
         
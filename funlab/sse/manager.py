@@ -1,20 +1,64 @@
 import logging
+import os
 import queue
 import threading
-import json
-import signal
-import atexit
+from collections import deque
 from datetime import datetime, timedelta, timezone
-from typing import Dict, Any, Set
-from flask import Flask
+from typing import Dict, Any
 from funlab.core.dbmgr import DbMgr
-from funlab.flaskr.app import FunlabFlask
 from funlab.utils import log
-from sqlalchemy import create_engine, select
-from sqlalchemy.orm import Session, scoped_session, sessionmaker
-from contextlib import contextmanager
+from sqlalchemy import delete, insert, or_, select
 
-from .model import EventBase, EventPriority, PayloadBase, ServerSideEvent, EventEntity
+from .model import EventBase, EventPriority, PayloadBase, EventEntity
+
+# Pushed onto the global queue at shutdown to wake the distributor's
+# blocking get immediately instead of waiting out the timeout
+_SHUTDOWN_SENTINEL = object()
+
+class _RingQueue:
+    """deque + Event stand-in for queue.Queue on the producer->distributor
+    hop. append/popleft are atomic under the GIL, so neither side takes a
+    mutex; maxlen silently drops the oldest event when the ring is full.
+    Exposes the small queue.Queue subset the manager uses."""
+
+    def __init__(self, maxsize: int):
+        self._ring = deque(maxlen=maxsize)
+        self._nonempty = threading.Event()
+
+    def put_nowait(self, item):
+        self._ring.append(item)
+        self._nonempty.set()
+
+    # try_push/try_pop signal full/empty through the return value, so the
+    # overflow and drain paths never pay for a raised-and-caught exception
+    def try_push(self, item) -> bool:
+        self._ring.append(item)
+        self._nonempty.set()
+        return True  # maxlen ring accepts by evicting the oldest entry
+
+    def try_pop(self):
+        try:
+            return self._ring.popleft()
+        except IndexError:
+            self._nonempty.clear()
+            return None
+
+    def get(self, timeout=None):
+        if not self._ring and not self._nonempty.wait(timeout):
+            raise queue.Empty
+        return self.get_nowait()
+
+    def get_nowait(self):
+        item = self.try_pop()
+        if item is None:
+            raise queue.Empty
+        return item
+
+    def empty(self) -> bool:
+        return not self._ring
+
+    def qsize(self) -> int:
+        return len(self._ring)
 
 # class EventStorageSystem:
 #     def __init__(self, db_url):
@@ -60,133 +104,370 @@ from .model import EventBase, EventPriority, PayloadBase, ServerSideEvent, Event
 #                 event.status = EventStatus.DELIVERED
 #                 event.delivered_at = datetime.utcnow()
 class EventManager:
+    DISTRIBUTOR_BATCH_SIZE = 64
+
     def __init__(self, dbmgr:DbMgr, max_queue_size=1000, max_client_events=100):
         self.mylogger = log.get_logger(self.__class__.__name__, level=logging.INFO)
         self.dbmgr:DbMgr = dbmgr
-        self.global_event_queue: queue.Queue = queue.Queue(maxsize=max_queue_size)
-        self.user_event_queues: dict[int, queue.Queue] = {}
-        self.active_user_streams: dict[int, Set[queue.Queue]] = {}
+        self.global_event_queue = _RingQueue(max_queue_size)
+        # User events are sharded by user_id so producers touching
+        # different users never meet on one queue; broadcasts keep the
+        # dedicated global ring. One distributor thread drains each ring.
+        self.num_shards = min(os.cpu_count() or 1, 8)
+        self.user_event_shards = [_RingQueue(max_queue_size) for _ in range(self.num_shards)]
+        self.user_event_queues: dict[int, _RingQueue] = {}
+        # Structure-of-arrays view of the active streams: two parallel lists
+        # plus a user_id -> indices map, so global broadcast walks one flat
+        # list instead of a dict of sets (two levels of pointer chasing).
+        self._stream_list: list[_RingQueue] = []
+        self._stream_user: list[int] = []
+        self._user_to_indices: dict[int, list[int]] = {}
         self.max_client_events = max_client_events
-        self.lock = threading.Lock()
-        self.is_shutting_down = False
+        # Guards mutation of the stream lists/index map
+        self._map_lock = threading.RLock()
+        # Event instead of a plain bool: gives a properly synchronized,
+        # wait-able shutdown signal shared by all worker threads
+        self._shutdown = threading.Event()
+        # Memoized flat view of every queue; rebuilt only when a user queue
+        # is added, so readers get an O(1) tuple instead of a per-call build
+        self._all_queues_tuple: tuple = (self.global_event_queue, *self.user_event_shards)
+        # Write-behind insert buffer: rows accumulate here and the feeder
+        # flushes them as one multi-row INSERT per ~20 ms or 500 rows
+        self._insert_buffer: deque = deque()
+        self._insert_cv = threading.Condition()
         self._recover_stored_events()
-        self.distributor_thread = self.start_event_distributor()
+        self.distributor_threads = self.start_event_distributor()
+        self.cleanup_thread = self.start_cleanup_scheduler()
+        self.insert_feeder_thread = self.start_insert_feeder()
+
+    @property
+    def is_shutting_down(self) -> bool:
+        return self._shutdown.is_set()
 
     @property
-    def all_event_queues(self)->list[queue.Queue]:
-        return list(self.user_event_queues.values()).insert(0, self.global_event_queue)
+    def all_event_queues(self)->tuple:
+        return self._all_queues_tuple
+
+    def _get_user_event_queue(self, user_id: int) -> _RingQueue:
+        user_queue = self.user_event_queues.get(user_id)
+        if user_queue is None:
+            user_queue = _RingQueue(self.max_client_events)
+            self.user_event_queues[user_id] = user_queue
+            self._all_queues_tuple = (self.global_event_queue, *self.user_event_shards,
+                                      *self.user_event_queues.values())
+        return user_queue
+
+    def _shard_for(self, user_id) -> _RingQueue:
+        if user_id is None:
+            return self.global_event_queue
+        return self.user_event_shards[user_id % self.num_shards]
 
     def _recover_stored_events(self):
+        # One clock read for the whole batch: the cutoff is stable across
+        # rows and the hybrid is_expired would re-read the clock per row
+        now = datetime.now(timezone.utc)
         with self.dbmgr.session_context() as session:
-            stmt = select(EventEntity).where(EventEntity.is_expired() == False).order_by(EventEntity.created_at.asc())
-            unprocessed_events: list[EventEntity] = session.execute(stmt).scalars().all()
+            # limit + SKIP LOCKED so several recovering workers partition the
+            # backlog instead of double-delivering (no-op on SQLite)
+            stmt = (select(EventEntity)
+                    .where(or_(EventEntity.expired_at == None, EventEntity.expired_at > now))
+                    .order_by(EventEntity.created_at.asc())
+                    .limit(500)
+                    .with_for_update(skip_locked=True))
+            # only fetch rows whose event type is actually registered, so
+            # undeliverable rows never leave the database
+            registered_types = tuple(EventFactory._event_classes)
+            if registered_types:
+                stmt = stmt.where(EventEntity.event_type.in_(registered_types))
+            # Stream the rows instead of materializing the whole backlog;
+            # the loop stops as soon as a queue refuses more events
+            unprocessed_events = session.execute(stmt.execution_options(yield_per=50)).scalars()
             for event_record in unprocessed_events:
-                try:
-                    if event_record.is_global:
-                        self.global_event_queue.put_nowait(event_record.__dict__)
-                    else:
-                        self.user_event_queues[event_record.user_id].put_nowait(event_record.__dict__)
-                except queue.Full:
-                    break
-            session.commit()
+                # Plain dict in the shape create_events produces, copied out
+                # while the session is live: __dict__ is the ORM instance
+                # dict itself, which expire-on-commit empties as soon as the
+                # session context exits, leaving downstream consumers with
+                # events that have no 'type' key at all
+                event = {
+                    'type': event_record.event_type,
+                    'payload': event_record.payload,
+                    'user_id': event_record.target_userid,
+                    'created_at': event_record.created_at,
+                    'expired_at': event_record.expired_at,
+                    # these rows are still in the table; shutdown must not
+                    # re-insert them as duplicates
+                    'persist': False,
+                }
+                if event['user_id'] is None:
+                    self.global_event_queue.try_push(event)
+                else:
+                    self._get_user_event_queue(event['user_id']).try_push(event)
+
+    def _offer(self, stream: _RingQueue, event):
+        # The stream's maxlen ring evicts its oldest entry on overflow, so
+        # the old get_nowait/re-put Full dance is gone entirely
+        stream.try_push(event)
 
     def _distribute_global_event(self, event: dict[Any, Any]):
-        with self.lock:
-            for user_streams in self.active_user_streams.values():
-                for stream in user_streams:
-                    try:
-                        if stream.qsize() < self.max_client_events:
-                            stream.put_nowait(event)
-                    except queue.Full:
-                        stream.get_nowait()
-                        stream.put_nowait(event)
+        # Flat contiguous walk; list append/swap-pop are GIL-atomic, so a
+        # concurrent register/unregister at worst skips or repeats one
+        # stream for this event, which SSE tolerates.
+        for stream in self._stream_list:
+            self._offer(stream, event)
+
+    @staticmethod
+    def _event_target(event):
+        # Recovered rows carry target_userid, freshly created events user_id
+        if isinstance(event, dict):
+            return event.get('user_id') or event.get('target_userid')
+        return event.target_userid
+
+    def _deliver_many(self, user_id: int, events: list):
+        # Targeted delivery holds the map lock: unregister's swap-pop can
+        # move a different user's stream into a snapshotted index, and
+        # unlike the global walk, sending one user's event to another is
+        # not tolerable. register/unregister happen once per connection,
+        # so the lock is all but uncontended on this path.
+        with self._map_lock:
+            indices = self._user_to_indices.get(user_id)
+            if not indices:
+                return
+            for idx in indices:
+                stream = self._stream_list[idx]
+                for event in events:
+                    self._offer(stream, event)
 
     def _distribute_user_specific_event(self, event: Dict[Any, Any]):
-        user_id = event.get('user_id')
+        user_id = self._event_target(event)
         if user_id is None:
             return
+        self._deliver_many(user_id, [event])
 
-        with self.lock:
-            if user_id in self.active_user_streams:
-                for stream in self.active_user_streams[user_id]:
-                    try:
-                        if stream.qsize() < self.max_client_events:
-                            stream.put_nowait(event)
-                    except queue.Full:
-                        stream.get_nowait()
-                        stream.put_nowait(event)
+    def start_cleanup_scheduler(self, interval_minutes: int = 30):
+        def cleaner():
+            # wait() is both the sleep and the shutdown wakeup, so shutdown
+            # never has to sit out the remainder of an interval
+            while not self._shutdown.wait(timeout=interval_minutes * 60):
+                try:
+                    self.clean_up_events()
+                except Exception as e:
+                    self.mylogger.error(f"Event cleanup error: {e}")
 
-    def _store_event(self, event: dict[str, Any]):
+        cleanup_thread = threading.Thread(target=cleaner, daemon=True)
+        cleanup_thread.start()
+        return cleanup_thread
+
+    def clean_up_events(self):
+        """Purge expired events with one bulk DELETE; no rows are loaded
+        into Python and no per-row ORM delete bookkeeping happens."""
+        now = datetime.now(timezone.utc)
         with self.dbmgr.session_context() as session:
+            session.execute(
+                delete(EventEntity).where(EventEntity.expired_at <= now)
+            )
+            session.commit()
+
+    def _to_row(self, event: dict[str, Any]) -> dict[str, Any]:
+        expired_at = event.get('expired_at')
+        if isinstance(expired_at, str):
+            expired_at = datetime.fromisoformat(expired_at)
+        priority = event.get('priority') or EventPriority.NORMAL
+        if isinstance(priority, EventPriority):
+            priority = priority.value
+        return {
+            'event_type': event.get('type') or event.get('event_type'),
+            'payload': event.get('payload'),
+            'target_userid': self._event_target(event),
+            'priority': priority,
+            'created_at': event.get('created_at') or datetime.now(timezone.utc),
+            'expired_at': expired_at,
+        }
+
+    def _store_event(self, event: dict[str, Any]):
+        with self._insert_cv:
+            self._insert_buffer.append(self._to_row(event))
+            self._insert_cv.notify()
+
+    def start_insert_feeder(self):
+        def feeder():
+            while True:
+                with self._insert_cv:
+                    self._insert_cv.wait_for(
+                        lambda: self._insert_buffer or self._shutdown.is_set(),
+                        timeout=0.02)
+                    if not self._insert_buffer:
+                        if self._shutdown.is_set():
+                            return
+                        continue
+                self._flush_insert_buffer()
+
+        feeder_thread = threading.Thread(target=feeder, daemon=True)
+        feeder_thread.start()
+        return feeder_thread
 
-            session.add(queued_event)
+    def _flush_insert_buffer(self, max_rows: int = 500):
+        with self._insert_cv:
+            rows = []
+            while self._insert_buffer and len(rows) < max_rows:
+                rows.append(self._insert_buffer.popleft())
+        if not rows:
+            return
+        try:
+            with self.dbmgr.session_context() as session:
+                session.execute(insert(EventEntity), rows)
+                session.commit()
+        except Exception as e:
+            self.mylogger.error(f"Event insert flush error: {e}")
 
     def shutdown(self):
-        if self.is_shutting_down:
+        if self._shutdown.is_set():
             return
-        self.is_shutting_down = True
+        self._shutdown.set()
+        for ring in (self.global_event_queue, *self.user_event_shards):
+            ring.try_push(_SHUTDOWN_SENTINEL)
         self.mylogger.info("Shutting down event notification system...")
-        for queue in self.all_event_queues:
-            while not queue.empty():
-                try:
-                    event = queue.get_nowait()
-                    self._store_event(event)
-                except queue.Empty:
-                    break
+        # Undelivered ring events need no rescue: create_events buffered
+        # their rows the moment they were made, so their durable copy is
+        # already in the table (or in the insert buffer below) and boot
+        # recovery re-delivers them. Re-inserting them here wrote each
+        # one a second, identical row. Only the unflushed insert buffer
+        # still holds work.
+        while self._insert_buffer:
+            self._flush_insert_buffer()
         self.mylogger.info("All unprocessed events have been saved")
 
     def start_event_distributor(self):
-        def distributor():
+        def distributor(ring: _RingQueue):
             while not self.is_shutting_down:
                 try:
-                    for queue in self.all_event_queues:
-                        while not queue.empty():
-                            event: ServerSideEvent = queue.get(timeout=1)
-                            if event.is_global():
-                                self._distribute_global_event(event)
-                            else:
-                                self._distribute_user_specific_event(event)
+                    # No timeout: the ring's Event wakes us when a producer
+                    # pushes, and shutdown pushes a sentinel, so an idle
+                    # distributor sleeps instead of polling once a second
+                    event = ring.get()
                 except queue.Empty:
+                    # stale wakeup after a drained burst; just re-block
                     continue
+                if event is _SHUTDOWN_SENTINEL:
+                    break
+                # Drain up to a batch per wakeup to amortize the queue's
+                # internal lock over many events
+                batch = [event]
+                while len(batch) < self.DISTRIBUTOR_BATCH_SIZE:
+                    event = ring.try_pop()
+                    if event is None or event is _SHUTDOWN_SENTINEL:
+                        break
+                    batch.append(event)
+                # Bucket the batch by target so each user's stream lookup
+                # happens once per batch rather than once per event
+                global_events = []
+                per_user: dict[int, list] = {}
+                for event in batch:
+                    user_id = self._event_target(event)
+                    if user_id is None:
+                        global_events.append(event)
+                    else:
+                        per_user.setdefault(user_id, []).append(event)
+                try:
+                    for event in global_events:
+                        self._distribute_global_event(event)
+                    for user_id, events in per_user.items():
+                        self._deliver_many(user_id, events)
                 except Exception as e:
                     self.mylogger.error(f"Event distribution error: {e}")
 
-        distributor_thread = threading.Thread(target=distributor, daemon=True)
-        distributor_thread.start()
-        return distributor_thread
+        threads = []
+        for ring in (self.global_event_queue, *self.user_event_shards):
+            distributor_thread = threading.Thread(target=distributor, args=(ring,), daemon=True)
+            distributor_thread.start()
+            threads.append(distributor_thread)
+        return threads
+
+    def user_online(self, user_id: int) -> bool:
+        # Membership probe only; never materializes a stream collection
+        return bool(self._user_to_indices.get(user_id))
 
-    def register_user_stream(self, user_id: int) -> queue.Queue:
-        with self.lock:
-            user_stream = queue.Queue(maxsize=self.max_client_events)
-            if user_id not in self.active_user_streams:
-                self.active_user_streams[user_id] = set()
-            self.active_user_streams[user_id].add(user_stream)
+    def register_user_stream(self, user_id: int) -> _RingQueue:
+        with self._map_lock:
+            user_stream = _RingQueue(self.max_client_events)
+            # The offline queues are only fed by boot recovery and no
+            # distributor drains them since sharding; hand the backlog to
+            # the first stream this user opens, before live events can
+            # interleave ahead of it
+            offline = self.user_event_queues.pop(user_id, None)
+            if offline is not None:
+                while (event := offline.try_pop()) is not None:
+                    user_stream.try_push(event)
+            self._stream_list.append(user_stream)
+            self._stream_user.append(user_id)
+            self._user_to_indices.setdefault(user_id, []).append(len(self._stream_list) - 1)
             return user_stream
 
-    def unregister_user_stream(self, user_id: int, stream: queue.Queue):
-        with self.lock:
-            if user_id in self.active_user_streams:
-                self.active_user_streams[user_id].discard(stream)
-                if not self.active_user_streams[user_id]:
-                    del self.active_user_streams[user_id]
-
-
-    # def create_event(self, event_type: str, payload: Dict[Any, Any], user_id: int = None, expires_in: int = 3600):
-    #     event = {
-    #         'type': event_type,
-    #         'payload': payload,
-    #         'user_id': user_id,
-    #         'expired_at': (datetime.now(timezone.utc) + timedelta(seconds=expires_in)).isoformat()
-    #     }
-    #     self._store_event(event)
-    #     try:
-    #         self.global_event_queue.put_nowait(event)
-    #     except queue.Full:
-    #         try:
-    #             self.global_event_queue.get_nowait()
-    #             self.global_event_queue.put_nowait(event)
-    #         except:
-    #             pass
+    def unregister_user_stream(self, user_id: int, stream: _RingQueue):
+        with self._map_lock:
+            indices = self._user_to_indices.get(user_id)
+            if not indices:
+                return
+            idx = next((i for i in indices if self._stream_list[i] is stream), None)
+            if idx is None:
+                return
+            last = len(self._stream_list) - 1
+            if idx != last:
+                # swap-pop: move the last slot into the hole and fix its index
+                moved_user = self._stream_user[last]
+                self._stream_list[idx] = self._stream_list[last]
+                self._stream_user[idx] = moved_user
+                moved_indices = self._user_to_indices[moved_user]
+                moved_indices[moved_indices.index(last)] = idx
+            self._stream_list.pop()
+            self._stream_user.pop()
+            indices.remove(idx)
+            if not indices:
+                del self._user_to_indices[user_id]
+
+
+    def create_event(self, event_type: str, payload: Dict[Any, Any], user_id: int = None, expires_in: int = 3600,
+                     persist: bool = True):
+        self.create_events([{'event_type': event_type, 'payload': payload,
+                             'user_id': user_id, 'expires_in': expires_in,
+                             'persist': persist}])
+
+    def create_events(self, specs: list[dict]):
+        """Batch ingress: one clock read, one insert-buffer acquisition and
+        one feeder wakeup for the whole list, so producer cost per event
+        shrinks with batch size. Each spec is the create_event kwargs:
+        event_type, payload, user_id, expires_in and persist (all but
+        event_type optional)."""
+        # queue rings are already thread-safe, so no manager lock is taken
+        # around the pushes; only refuse new events once shutdown has begun
+        if self.is_shutting_down:
+            return
+        now = datetime.now(timezone.utc)
+        events = []
+        rows = []
+        for spec in specs:
+            expires_in = spec.get('expires_in', 3600)
+            event = {
+                'type': spec['event_type'],
+                'payload': spec.get('payload'),
+                'user_id': spec.get('user_id'),
+                'created_at': now,
+                # kept as a datetime so persisting it never reparses ISO text
+                'expired_at': now + timedelta(seconds=expires_in),
+                'persist': spec.get('persist', True)
+            }
+            events.append(event)
+            # persist=False marks fire-and-forget notifications (banners,
+            # progress ticks): they fan out in-process only and never cost
+            # an INSERT or survive a restart
+            if event['persist']:
+                rows.append(self._to_row(event))
+        if rows:
+            with self._insert_cv:
+                self._insert_buffer.extend(rows)
+                self._insert_cv.notify()
+        for event in events:
+            # the ring itself drops the oldest event when full
+            self._shard_for(event['user_id']).try_push(event)
 
 class EventFactory:
     _event_classes: dict[str, type[EventBase]] = {}
@@ -198,10 +479,11 @@ class EventFactory:
     @classmethod
     def create_event(cls, event_type: str, payload: PayloadBase,
                     target_userid: int = None, priority: EventPriority = EventPriority.NORMAL, is_read: bool = False,
-                    created_at: datetime = datetime.now(timezone.utc), expired_at: datetime = None, **kwargs) -> EventBase:
+                    created_at: datetime = None, expired_at: datetime = None, **kwargs) -> EventBase:
         if event_type not in cls._event_classes:
             raise ValueError(f"Unknown event type: {event_type}")
         event_class = cls._event_classes[event_type]
+        created_at = created_at or datetime.now(timezone.utc)
         return event_class(event_type=event_type, payload=payload,
                            target_userid=target_userid, priority=priority, is_read=is_read, created_at=created_at, expired_at=expired_at,
                            **kwargs)
@@ -5,23 +5,56 @@ from enum import Enum
 import time
 from flask import Response, stream_with_context
 from funlab.core import _Readable
-from pydantic import BaseModel
-from sqlalchemy import JSON, Boolean, Column, DateTime, Float, ForeignKey, Integer, String, UniqueConstraint, or_, select
+from sqlalchemy import JSON, Boolean, Column, DateTime, Float, ForeignKey, Index, Integer, SmallInteger, String, UniqueConstraint, or_, select
 from sqlalchemy.orm import relationship
-from sqlalchemy import Enum as SQLEnum
 from sqlalchemy.ext.hybrid import hybrid_property
 # all of application's entity, use same registry to declarate
 from funlab.core.appbase import APP_ENTITIES_REGISTRY as entities_registry
 #from sqlalchemy.orm import registry
 #entities_registry = registry()
 from tzlocal import get_localzone
-class PayloadBase(BaseModel):
+
+# get_localzone() can re-read /etc/localtime; resolve it once per process
+_LOCAL_TZ = get_localzone()
+
+try:
+    import orjson
+
+    def _json_dumps(obj) -> str:
+        return orjson.dumps(obj, default=str).decode()
+
+    def json_dumps_bytes(obj) -> bytes:
+        return orjson.dumps(obj, default=str)
+
+    def _json_loads(s):
+        return orjson.loads(s)
+except ImportError:  # orjson is optional; stdlib json is the fallback
+    import json
+
+    def _json_dumps(obj) -> str:
+        return json.dumps(obj, default=str)
+
+    def json_dumps_bytes(obj) -> bytes:
+        return json.dumps(obj, default=str).encode()
+
+    def _json_loads(s):
+        return json.loads(s)
+
+@dataclass
+class PayloadBase:
+    """Plain-dataclass payload; serialization runs through orjson when
+    available instead of pydantic validation, which dominated the
+    per-event serialize/deserialize cost for these flat payloads."""
+
     @classmethod
     def from_jsonstr(cls, payload_str: str) -> 'PayloadBase':
-        return cls.model_validate_json(payload_str)
+        return cls(**_json_loads(payload_str))
 
     def to_json(self):
-        return self.model_dump_json()
+        # vars() hands the encoder the instance dict directly; asdict()
+        # would deep-copy every field through the dataclass recursion
+        # machinery, which these flat payloads never need
+        return _json_dumps(vars(self))
 
 class EventPriority(Enum):
     LOW = 0
@@ -35,7 +68,9 @@ class EventBase(_Readable):
     target_userid: int = None
     priority: EventPriority = EventPriority.NORMAL
     is_read: bool = False
-    created_at: datetime = datetime.now(timezone.utc)
+    # default_factory: a bare datetime.now() default would be evaluated once
+    # at class-definition time and shared by every instance
+    created_at: datetime = field(default_factory=lambda: datetime.now(timezone.utc))
     expired_at: datetime = None
 
     @property
@@ -44,7 +79,12 @@ class EventBase(_Readable):
 
     @property
     def is_expired(self):
-        return self.expired_at and datetime.now(timezone.utc) > self.expired_at
+        return self.is_expired_at(datetime.now(timezone.utc))
+
+    def is_expired_at(self, now: datetime) -> bool:
+        """Expiry test against a caller-supplied clock reading, so loops
+        scanning many events read the clock once instead of per event."""
+        return self.expired_at is not None and now > self.expired_at
 
     def to_json(self):
         return super().to_json()
@@ -53,17 +93,33 @@ class EventBase(_Readable):
         """ Format the event as a Server-Sent Event. """
         return f"event: {self.event_type}\ndata: {self.payload.to_json()}\n\n"
 
+    def to_frame(self) -> bytes:
+        """ Cached bytes form of to_sse(), so an event fanned out to N
+        subscribers is serialized once instead of N times. """
+        frame = getattr(self, '_sse_frame', None)
+        if frame is None:
+            frame = self.to_sse().encode()
+            self._sse_frame = frame
+        return frame
+
 @entities_registry.mapped
 @dataclass
 class EventEntity(EventBase):
     __tablename__ = 'event'
     __sa_dataclass_metadata_key__ = 'sa'
+    # composite index matching the inbox/recovery access path: filter by
+    # target user (NULL rows are the globals), newest first
+    __table_args__ = (Index('ix_event_target_userid_created_at', 'target_userid', 'created_at'),)
 
     id: int = field(init=False, metadata={'sa': Column(Integer, primary_key=True, autoincrement=True)})
     event_type: str = field(metadata={'sa': Column(String(50), nullable=False)})
     payload: PayloadBase = field(metadata={'sa': Column(JSON, nullable=False)})
     target_userid: int = field(default=None, metadata={'sa': Column(Integer, ForeignKey('user.id'), nullable=True)})
-    priority: EventPriority = field(default=None, metadata={'sa': Column(SQLEnum(EventPriority), default=EventPriority.NORMAL, nullable=False)})
+    # SmallInteger rather than SQLEnum: the enum column stores VARCHAR on
+    # most backends and coerces through the Enum machinery on every row
+    # load; the int compares and sorts natively (priority.desc() ordering
+    # now matches the enum's numeric ranking, too)
+    priority: int = field(default=EventPriority.NORMAL.value, metadata={'sa': Column(SmallInteger, default=EventPriority.NORMAL.value, nullable=False)})
     # is_read: bool = field(default=False, metadata={'sa': Column(Boolean, default=False, nullable=False)})
 
     created_at: datetime = field(default_factory=lambda: datetime.now(timezone.utc), metadata={'sa': Column(DateTime(timezone=True), nullable=False)})
@@ -87,7 +143,11 @@ class EventEntity(EventBase):
 
     @hybrid_property
     def is_expired(self):
-        return self.expired_at and datetime.now(timezone.utc) > self.expired_at
+        return self.is_expired_at(datetime.now(timezone.utc))
+
+    @property
+    def priority_enum(self) -> EventPriority:
+        return EventPriority(self.priority)
 
     def to_dto(self):  # EventBase, Data transfer object
         if isinstance(self.payload, str):
@@ -99,7 +159,7 @@ class EventEntity(EventBase):
             event_type=self.event_type,
             payload=payload,
             target_userid=self.target_userid,
-            priority=self.priority,
+            priority=self.priority_enum,
             is_read=self.is_read,
             created_at=self.created_at,
             expired_at=self.expired_at
@@ -111,15 +171,13 @@ class EventEntity(EventBase):
     @property
     def local_created_at(self):
         """Convert created_at to the local timezone for display."""
-        local_tz = get_localzone()
-        return self.created_at.astimezone(local_tz)
+        return self.created_at.astimezone(_LOCAL_TZ)
 
     @property
     def local_expires_at(self):
         """Convert expired_at to the local timezone for display."""
         if self.expired_at:
-            local_tz = get_localzone()
-            return self.expired_at.astimezone(local_tz)
+            return self.expired_at.astimezone(_LOCAL_TZ)
         return None
 
 @entities_registry.mapped
@@ -127,6 +185,9 @@ class EventEntity(EventBase):
 class ReadEventUsers:
     __tablename__ = 'read_event_users'
     __sa_dataclass_metadata_key__ = 'sa'
+    # the mark-read INSERT..SELECT probes (event_id, user_id) existence on
+    # every click; without this it walks the PK index and filters the heap
+    __table_args__ = (Index('ix_read_event_users_event_user', 'event_id', 'user_id'),)
 
     id: int = field(init=False, metadata={'sa': Column(Integer, primary_key=True, autoincrement=True)})
     event_id: int = field(metadata={'sa': Column(Integer, ForeignKey('event.id'), nullable=False)})
@@ -134,6 +195,7 @@ class ReadEventUsers:
     read_at: datetime = field(default_factory=lambda: datetime.now(timezone.utc), metadata={'sa': Column(DateTime(timezone=True), nullable=False)})
 
     event: EventEntity = field(metadata={'sa': relationship('EventEntity', back_populates='read_users')})
+@dataclass
 class TaskCompletedPayload(PayloadBase):
     task_name: str
     task_result: str
@@ -146,12 +208,12 @@ class TaskCompletedEvent(EventBase):
 
     def __init__(self, task_name: str, task_result: str, task_start_time: datetime, task_end_time: datetime,
                  target_userid: int = None, priority: EventPriority = EventPriority.NORMAL, is_read: bool = False,
-                 created_at: datetime = datetime.now(timezone.utc), expired_at: datetime = None):
+                 created_at: datetime = None, expired_at: datetime = None):
         self.payload = TaskCompletedPayload(task_name=task_name, task_result=task_result, task_start_time=task_start_time, task_end_time=task_end_time)
         self.target_userid = target_userid
         self.priority = priority
         self.is_read = is_read
-        self.created_at = created_at
+        self.created_at = created_at or datetime.now(timezone.utc)
         self.expired_at = expired_at
 
     def __str__(self):
@@ -1,20 +1,66 @@
+import atexit
 from datetime import datetime, timedelta, timezone
-import json
+import queue
+import random
 import time
 
-from flask import (Response, flash, g, jsonify, redirect, render_template, request, stream_with_context,
-                   url_for, current_app)
+from flask import Response, jsonify, render_template, request, stream_with_context
 from flask_login import current_user, login_required
-from funlab.core.menu import Menu, MenuItem
-from funlab.core.plugin import ServicePlugin, ViewPlugin
-from sqlalchemy import and_, or_, select, update
-
-from flask_restx import Api, Resource, Namespace
+from funlab.core.plugin import ServicePlugin
+from sqlalchemy import DateTime, Integer, bindparam, exists, insert, or_, select
 
 from funlab.flaskr.app import FunlabFlask
-from .model import EventBase, EventEntity, EventPriority, PayloadBase
+from .model import EventBase, EventEntity, EventPriority, PayloadBase, ReadEventUsers, json_dumps_bytes
 from .manager import EventManager
 
+# SSE comment line: keeps proxies and load balancers from timing the
+# connection out without waking client-side event handlers
+_HEARTBEAT_FRAME = b': keepalive\n\n'
+HEARTBEAT_INTERVAL = 10  # seconds
+
+# The mark-read statement is built once at import; per-request work is a
+# bindparam dict, and SQLAlchemy's compiled cache gets a stable key
+_STMT_MARK_READ = insert(ReadEventUsers).from_select(
+    ['event_id', 'user_id', 'read_at'],
+    select(bindparam('eid', type_=Integer),
+           bindparam('uid', type_=Integer),
+           bindparam('ts', type_=DateTime(timezone=True)))
+    .where(
+        exists(select(EventEntity.id).where(
+            EventEntity.id == bindparam('eid'),
+            or_(EventEntity.target_userid == bindparam('uid'),
+                EventEntity.target_userid == None))),
+        ~exists(select(ReadEventUsers.id).where(
+            ReadEventUsers.event_id == bindparam('eid'),
+            ReadEventUsers.user_id == bindparam('uid')))))
+
+# get_user_events statements, built once per filter combination and kept
+# here so repeat calls skip the Python-level select().where() chain and
+# always hand SQLAlchemy's compiled-statement cache the same object
+_USER_EVENTS_STMTS: dict[tuple, object] = {}
+
+def _user_events_stmt(has_type: bool, has_priority: bool, include_expired: bool, has_limit: bool):
+    key = (has_type, has_priority, include_expired, has_limit)
+    stmt = _USER_EVENTS_STMTS.get(key)
+    if stmt is None:
+        stmt = select(EventEntity.id, EventEntity.event_type, EventEntity.payload,
+                      EventEntity.priority, EventEntity.created_at, EventEntity.expired_at,
+                      EventEntity.target_userid).where(
+            or_(EventEntity.target_userid == bindparam('uid', type_=Integer),
+                EventEntity.target_userid == None))
+        if not include_expired:
+            stmt = stmt.where(or_(EventEntity.expired_at == None,
+                                  EventEntity.expired_at > bindparam('now', type_=DateTime(timezone=True))))
+        if has_type:
+            stmt = stmt.where(EventEntity.event_type == bindparam('etype'))
+        if has_priority:
+            stmt = stmt.where(EventEntity.priority == bindparam('prio', type_=Integer))
+        stmt = stmt.order_by(EventEntity.priority.desc(), EventEntity.created_at.desc())
+        if has_limit:
+            stmt = stmt.limit(bindparam('lim', type_=Integer))
+        _USER_EVENTS_STMTS[key] = stmt
+    return stmt
+
 class SSEService(ServicePlugin):
     _event_classes: dict[str, type[EventBase]] = {}
 
@@ -25,10 +71,11 @@ class SSEService(ServicePlugin):
     @classmethod
     def create_event(cls, event_type: str, payload: PayloadBase,
                     target_userid: int = None, priority: EventPriority = EventPriority.NORMAL, is_read: bool = False,
-                    created_at: datetime = datetime.now(timezone.utc), expired_at: datetime = None, **kwargs) -> EventBase:
+                    created_at: datetime = None, expired_at: datetime = None, **kwargs) -> EventBase:
         if event_type not in cls._event_classes:
             raise ValueError(f"Unknown event type: {event_type}")
         event_class = cls._event_classes[event_type]
+        created_at = created_at or datetime.now(timezone.utc)
         return event_class(event_type=event_type, payload=payload,
                            target_userid=target_userid, priority=priority, is_read=is_read, created_at=created_at, expired_at=expired_at,
                            **kwargs)
@@ -41,22 +88,107 @@ class SSEService(ServicePlugin):
     def init_app(self, app: FunlabFlask):
         self.dbmgr = app.dbmgr
         self.sse_mgr = EventManager(self.dbmgr)
-        self.app.teardown_appcontext(self.teardown)
+        # Process-lifetime singleton: teardown_appcontext would run after
+        # every request and shut the manager down on the first one
+        atexit.register(self.sse_mgr.shutdown)
 
-    def teardown(self, exception):
-        self.sse_mgr.shutdown()
+    # "event: <type>\ndata: " encoded once per event type ever seen, so
+    # frame assembly is two bytes concatenations with no str->utf8 pass
+    _frame_prefixes: dict[str, bytes] = {}
+
+    @classmethod
+    def _event_frame(cls, event) -> bytes:
+        # The same dict object is fanned out to every subscriber, so the
+        # first stream to serialize it caches the wire bytes for the others
+        frame = event.get('_frame')
+        if frame is None:
+            event_type = event['type']
+            prefix = cls._frame_prefixes.get(event_type)
+            if prefix is None:
+                prefix = cls._frame_prefixes.setdefault(
+                    event_type, f"event: {event_type}\ndata: ".encode())
+            frame = prefix + json_dumps_bytes(event.get('payload')) + b"\n\n"
+            created_at = event.get('created_at')
+            if created_at is not None:
+                # id: lets the browser resend Last-Event-ID on reconnect;
+                # the epoch of created_at is monotonic enough to replay from
+                frame = b"id: %.6f\n" % created_at.timestamp() + frame
+            event['_frame'] = frame
+        return frame
+
+    def _replay_missed(self, user_id, last_event_id, user_stream):
+        """Queue the events this user missed since the frame id the browser
+        sent back, so a reconnect transfers the gap, not the whole backlog."""
+        try:
+            since = datetime.fromtimestamp(float(last_event_id), tz=timezone.utc)
+        except (TypeError, ValueError):
+            return
+        now = datetime.now(timezone.utc)
+        sa_session = self.app.dbmgr.get_db_session()
+        # Server-side cursor: rows stream into the ring as fetched instead
+        # of materializing a big backlog list (a generator on SQLite)
+        rows = sa_session.execute(
+            select(EventEntity.event_type, EventEntity.payload, EventEntity.target_userid,
+                   EventEntity.created_at, EventEntity.expired_at)
+            .where(EventEntity.created_at > since,
+                   or_(EventEntity.target_userid == user_id, EventEntity.target_userid == None),
+                   or_(EventEntity.expired_at == None, EventEntity.expired_at > now))
+            .order_by(EventEntity.created_at.asc())
+            .execution_options(yield_per=100))
+        for row in rows:
+            user_stream.try_push({'type': row.event_type, 'payload': row.payload,
+                                  'user_id': row.target_userid, 'created_at': row.created_at,
+                                  'expired_at': row.expired_at})
+
+    def sse_stream(self, user_id, event_types=None):
+        last_event_id = request.headers.get('Last-Event-ID')
+        interval = self.app.config.get('SSE_HEARTBEAT_SEC', HEARTBEAT_INTERVAL)
 
-    def sse_stream(self, user_id, event_types):
         def event_stream():
             user_stream = self.sse_mgr.register_user_stream(user_id)
+            if last_event_id:
+                self._replay_missed(user_id, last_event_id, user_stream)
+
+            # Monotonic deadline rather than resetting a timeout per event:
+            # a chatty stream still heartbeats on schedule and a quiet one
+            # never waits longer than the interval. The jitter staggers the
+            # streams so a proxy restart doesn't make every connection
+            # heartbeat (and potentially reconnect) in the same tick.
+            def next_deadline():
+                return time.monotonic() + interval + random.uniform(-1, 1)
+
+            next_heartbeat = next_deadline()
             try:
                 while True:
-                    event = user_stream.get()
-                    if event['type'] in event_types:
-                        yield f"event: {event['type']}\ndata: {json.dumps(event['data'])}\n\n"
+                    remaining = next_heartbeat - time.monotonic()
+                    if remaining <= 0:
+                        yield _HEARTBEAT_FRAME
+                        next_heartbeat = next_deadline()
+                        continue
+                    try:
+                        # One blocking get, then drain whatever else the
+                        # burst delivered so the whole batch goes out in one
+                        # write instead of one TCP send per event
+                        events = [user_stream.get(timeout=remaining)]
+                    except queue.Empty:
+                        continue
+                    while (more := user_stream.try_pop()) is not None:
+                        events.append(more)
+                    frames = [self._event_frame(event) for event in events
+                              if event_types is None or event['type'] in event_types]
+                    if frames:
+                        yield b''.join(frames)
             finally:
                 self.sse_mgr.unregister_user_stream(user_id, user_stream)
-        return Response(stream_with_context(event_stream()), content_type='text/event-stream')
+        response = Response(stream_with_context(event_stream()), content_type='text/event-stream',
+                            headers={'Cache-Control': 'no-cache',
+                                     # stop nginx and friends from holding
+                                     # frames until their buffer fills
+                                     'X-Accel-Buffering': 'no',
+                                     'Connection': 'keep-alive'})
+        # skip Werkzeug's own chunk buffering as well
+        response.direct_passthrough = True
+        return response
 
     def register_routes(self):
         @self.blueprint.route('/events')
@@ -75,27 +207,49 @@ class SSEService(ServicePlugin):
             success = self.mark_event_as_read(event_id, current_user.id)
             return jsonify({'success': success})
 
-    def get_user_events(self, user_id, event_type=None, priority=None, include_expired=False):
-        stmt = select(EventEntity).where(or_(EventEntity.user_id == user_id, EventEntity.is_global == True))
+    def get_user_events(self, user_id, event_type=None, priority=None, include_expired=False,
+                        limit=50, stream=False):
+        """Inbox listing as a column-only select: no EventEntity instances
+        are materialized and expiry is filtered in the WHERE clause rather
+        than per row in Python. Returns RowMapping objects (dict-like).
+        limit caps the page at the newest rows (None for everything).
+        stream=True returns an iterator over a server-side cursor instead
+        of a materialized list, for bulk callers passing limit=None.
+        The statement for each filter combination is built once (module
+        cache); per call only the bindparam dict changes."""
+        stmt = _user_events_stmt(event_type is not None, priority is not None,
+                                 include_expired, limit is not None)
+        params = {'uid': user_id}
         if not include_expired:
-            stmt = stmt.where(or_(EventEntity.is_expired == False))
-        if event_type:
-            stmt = stmt.where(EventEntity.event_type == event_type)
-        if priority:
-            stmt = stmt.where(EventEntity.priority == priority.value)
-        stmt = stmt.order_by(EventEntity.priority.desc(), EventEntity.created_at.desc())
+            params['now'] = datetime.now(timezone.utc)
+        if event_type is not None:
+            params['etype'] = event_type
+        if priority is not None:
+            params['prio'] = priority.value
+        if limit is not None:
+            params['lim'] = limit
         sa_session = self.app.dbmgr.get_db_session()
-        result = sa_session.execute(stmt).scalars().all()
-        return result
+        if stream:
+            # rows arrive in 500-row fetches as the caller iterates, so an
+            # unbounded scan never holds the whole table in memory
+            return sa_session.execute(
+                stmt.execution_options(yield_per=500), params).mappings()
+        return sa_session.execute(stmt, params).mappings().all()
 
     def mark_event_as_read(self, event_id, user_id):
+        """Record the read marker with one conditional INSERT..SELECT: the
+        statement itself checks that the event exists, targets this user
+        (or is global) and is not already read, so the old load-mutate
+        round trip pair collapses into a single statement. Reads are
+        tracked per user in read_event_users; the old code flipped the
+        unmapped is_read attribute, which was never persisted."""
         sa_session = self.app.dbmgr.get_db_session()
-        event: EventEntity = sa_session.execute(select(EventEntity).where(EventEntity.id == event_id)).scalar_one_or_none()
-        if event and (event.user_id == user_id or event.is_global):
-            event.is_read = True
-            sa_session.commit()
-            return True
-        return False
+        rowcount = sa_session.execute(
+            _STMT_MARK_READ,
+            {'eid': event_id, 'uid': user_id, 'ts': datetime.now(timezone.utc)}
+        ).rowcount
+        sa_session.commit()
+        return rowcount > 0
 
 
     def start_service(self):